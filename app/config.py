@@ -2,57 +2,91 @@
 Configuration settings for the Lotus Chess application
 """
 import os
+import sys
 import logging
+import functools
 from dotenv import load_dotenv
 from pathlib import Path
 
 # Load environment variables from .env file if it exists
 load_dotenv()
 
+# Bind the environment mapping once so every setting is a single dict lookup
+_env = os.environ
+
+
+def _get(key, default=None, cast=str):
+    """Read an environment variable, casting it only when it is set"""
+    value = _env.get(key)
+    if value is None:
+        return default
+    return cast(value)
+
+
 # API Settings
-API_HOST = os.getenv("API_HOST", "0.0.0.0")
-API_PORT = int(os.getenv("API_PORT", 8000))
+API_HOST = _get("API_HOST", "0.0.0.0")
+API_PORT = _get("API_PORT", 8000, int)
 
 # Lichess API Settings
-LICHESS_API_URL = os.getenv("LICHESS_API_URL", "https://lichess.org/api")
-LICHESS_API_TOKEN = os.getenv("LICHESS_API_TOKEN", "")  # Optional
-LICHESS_RATE_LIMIT_DELAY = float(os.getenv("LICHESS_RATE_LIMIT_DELAY", 0.05))  # 20 req/sec
+LICHESS_API_URL = _get("LICHESS_API_URL", "https://lichess.org/api")
+LICHESS_API_TOKEN = _get("LICHESS_API_TOKEN", "")  # Optional
+LICHESS_RATE_LIMIT_DELAY = _get("LICHESS_RATE_LIMIT_DELAY", 0.05, float)  # 20 req/sec
+LICHESS_MAX_CONCURRENT_REQUESTS = _get("LICHESS_MAX_CONCURRENT_REQUESTS", 4, int)
 
 # Redis Configuration for caching and Celery
-REDIS_HOST = os.getenv("REDIS_HOST", "localhost")
-REDIS_PORT = int(os.getenv("REDIS_PORT", 6379))
-REDIS_DB = int(os.getenv("REDIS_DB", 0))
-REDIS_URL = os.getenv("REDIS_URL", f"redis://{REDIS_HOST}:{REDIS_PORT}/{REDIS_DB}")
+REDIS_HOST = _get("REDIS_HOST", "localhost")
+REDIS_PORT = _get("REDIS_PORT", 6379, int)
+REDIS_DB = _get("REDIS_DB", 0, int)
+REDIS_URL = _env.get("REDIS_URL") or f"redis://{REDIS_HOST}:{REDIS_PORT}/{REDIS_DB}"
 
 # Cache settings
-CACHE_TIMEOUT = int(os.getenv("CACHE_TIMEOUT", 86400))  # 24 hours in seconds
+CACHE_TIMEOUT = _get("CACHE_TIMEOUT", 86400, int)  # 24 hours in seconds
+POSITION_CACHE_TIMEOUT = _get("POSITION_CACHE_TIMEOUT", 30 * 86400, int)  # shared position table lifetime, 30 days
 
 # Log the Lichess API URL being used
 logging.info(f"Using Lichess API at: {LICHESS_API_URL}")
 
 # Stockfish Settings
-STOCKFISH_PATH = os.getenv("STOCKFISH_PATH", None)
-ANALYSIS_TIME = float(os.getenv("ANALYSIS_TIME", 2.0))  # seconds per position
-ANALYSIS_DEPTH = int(os.getenv("ANALYSIS_DEPTH", 18))  # analysis depth
-CANDIDATE_MOVES = int(os.getenv("CANDIDATE_MOVES", 3))  # number of candidate moves
+STOCKFISH_PATH = _get("STOCKFISH_PATH")  # Resolved lazily by get_stockfish_path()
+ANALYSIS_TIME = _get("ANALYSIS_TIME", 2.0, float)  # seconds per position
+ANALYSIS_DEPTH = _get("ANALYSIS_DEPTH", 18, int)  # analysis depth
+CANDIDATE_MOVES = _get("CANDIDATE_MOVES", 3, int)  # number of candidate moves
+SHALLOW_DEPTH = _get("SHALLOW_DEPTH", 8, int)  # depth of the first, quick search of each position
+CLEAR_MOVE_MARGIN = _get("CLEAR_MOVE_MARGIN", 0.5, float)  # pawns the best move must lead by to skip the full search
+ENGINE_POOL_SIZE = _get("ENGINE_POOL_SIZE", 8, int)  # Stockfish processes per analysis
+ENGINE_HASH_MB = _get("ENGINE_HASH_MB", 256, int)  # Stockfish hash table size per engine
+ENGINE_THREADS = _get("ENGINE_THREADS", 1, int)  # search threads per engine
+
+# Position cache (transposition table) settings
+TT_SIZE_MB = _get("TT_SIZE_MB", 64, int)  # memory budget for cached position analyses
+TT_ENTRY_BYTES = 400  # rough size of one cached entry (hash key, eval and best-move list)
+TT_ENTRIES = max(1, TT_SIZE_MB * 1024 * 1024 // TT_ENTRY_BYTES)
+
+
+@functools.lru_cache(maxsize=1)
+def get_stockfish_path() -> str:
+    """Return the Stockfish executable path, determining the OS default on first use"""
+    if STOCKFISH_PATH is not None:
+        return STOCKFISH_PATH
 
-# Determine default Stockfish path based on OS if not set
-if STOCKFISH_PATH is None:
     base_path = Path(__file__).parent.parent / "stockfish"
-    
-    import platform
-    if platform.system() == "Windows":
-        STOCKFISH_PATH = str(base_path / "stockfish-windows-x86-64-avx2.exe")
-    elif platform.system() == "Darwin":  # macOS
-        if platform.processor() == 'arm':
-            STOCKFISH_PATH = str(base_path / "stockfish-macos-arm")
+
+    # sys.platform and os.uname() are plain lookups, unlike platform.processor()
+    # which may shell out to uname
+    if sys.platform == "win32":
+        path = str(base_path / "stockfish-windows-x86-64-avx2.exe")
+    elif sys.platform == "darwin":  # macOS
+        if os.uname().machine == "arm64":
+            path = str(base_path / "stockfish-macos-arm")
         else:
-            STOCKFISH_PATH = str(base_path / "stockfish-macos-x86")
+            path = str(base_path / "stockfish-macos-x86")
     else:  # Linux and others
-        STOCKFISH_PATH = str(base_path / "stockfish-ubuntu-x86-64-avx2")
-    
+        path = str(base_path / "stockfish-ubuntu-x86-64-avx2")
+
     # Log the selected Stockfish path
-    logging.info(f"Using Stockfish at: {STOCKFISH_PATH}")
+    logging.info(f"Using Stockfish at: {path}")
+    return path
+
 
 # Game retrieval settings
-MAX_GAMES = int(os.getenv("MAX_GAMES", 5))
+MAX_GAMES = _get("MAX_GAMES", 5, int)
@@ -3,32 +3,31 @@ Lotus Chess Web API - FastAPI application with caching, parallelization,
 WebSockets for progress updates, and Celery task queue integration.
 """
 import asyncio
+import re
 import time
-import json
 import uuid
-import threading
+import orjson
 import sys
 from loguru import logger
-from fastapi import FastAPI, HTTPException, Depends, Request, BackgroundTasks, WebSocket
+from fastapi import FastAPI, HTTPException, Depends, Request, WebSocket
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse, RedirectResponse
+from fastapi.responses import JSONResponse, ORJSONResponse, RedirectResponse
 from fastapi.websockets import WebSocketDisconnect
 from fastapi.staticfiles import StaticFiles
-import uvicorn
-import os
-import sys
-import redis
 from pathlib import Path
-from celery.result import AsyncResult
-import socketio
-from celery.signals import task_postrun, task_success, task_failure
+from typing import Dict, Set
+from cachetools import LRUCache, TTLCache
+from celery import states
+from celery.signals import task_postrun
 
-# Add the parent directory to the Python path so imports work correctly
-sys.path.insert(0, str(Path(__file__).parent.parent))
+# Add the parent directory to the Python path so imports work correctly when run as a script
+ROOT_DIR = str(Path(__file__).parent.parent)
+if ROOT_DIR not in sys.path:
+    sys.path.insert(0, ROOT_DIR)
 
 from app.services.analysis_service import AnalysisService
 from app.services.cache_service import CacheService
-from app.models.analysis import AnalysisRequest, AnalysisResponse, AnalysisJobStatus, ProgressUpdate
+from app.models.analysis import AnalysisRequest, AnalysisResponse, AnalysisJobStatus
 from app.config import API_HOST, API_PORT, REDIS_URL
 from app.tasks import celery_app, analyze_games_task
 
@@ -50,7 +49,8 @@ for handler in config["handlers"]:
 app = FastAPI(
     title="Lotus Chess Analysis Service",
     description="A service for analyzing chess games using Stockfish",
-    version="1.0.0"
+    version="1.0.0",
+    default_response_class=ORJSONResponse
 )
 
 # Add CORS middleware
@@ -62,34 +62,88 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Initialize Socket.IO for WebSocket communication
-sio = socketio.AsyncServer(async_mode='asgi', cors_allowed_origins='*')
-# Create Socket.IO app and mount it at the root so it handles its own paths
-socket_app = socketio.ASGIApp(sio)
-# Include the Socket.IO app in the main ASGI app routing
-app.mount("/socket.io", socket_app)  # Mount at standard Socket.IO path
+# Socket.IO server, created on startup by setup_socketio()
+sio = None
+
+# Socket.IO event name for job progress updates
+_JOB_UPDATE_EVENT = 'job_update'
+
+# Job subscribers, keyed by job_id: Socket.IO sids and legacy WebSocket connections
+_sio_subs: Dict[str, Set[str]] = {}
+_ws_subs: Dict[str, Set[WebSocket]] = {}
 
-# Create a dictionary to store active WebSocket connections
-websocket_connections = {}
+def _subscribe(table, job_id, conn):
+    """Add a connection to a job's subscriber set"""
+    table.setdefault(job_id, set()).add(conn)
+
+def _unsubscribe(table, job_id, conn):
+    """Remove a connection from a job's subscriber set, dropping empty sets"""
+    subscribers = table.get(job_id)
+    if subscribers is not None:
+        subscribers.discard(conn)
+        if not subscribers:
+            table.pop(job_id, None)
 
 # Initialize cache service
 cache_service = CacheService()
 
+# Usernames recently found missing from the analysis cache, so repeated
+# requests during an analysis skip the cache round-trip
+_analysis_misses = TTLCache(maxsize=4096, ttl=30)
+
+# Username of each job started here, used to clear its miss entry on completion
+_job_usernames = TTLCache(maxsize=4096, ttl=3600)
+
+async def _get_cached_analysis(username, raw=False):
+    """Get a user's cached analysis (as a JSON string if raw), or None if not cached"""
+    if username in _analysis_misses:
+        return None
+
+    if raw:
+        cached_result = await cache_service.get_analysis_raw(username)
+    else:
+        cached_result = await cache_service.get_analysis(username)
+
+    if not cached_result:
+        _analysis_misses[username] = True
+    return cached_result
+
+# Shared Celery control handle for health checks
+_inspector = celery_app.control.inspect(timeout=0.5)
+
+# Short-lived cache of task metadata so repeated polls skip the result backend
+_task_meta_cache = TTLCache(maxsize=4096, ttl=0.5)
+
+def _get_task_meta(job_id):
+    """Return the Celery task metadata ({'status', 'result', ...}) for a job"""
+    meta = _task_meta_cache.get(job_id)
+    if meta is None:
+        meta = celery_app.backend.get_task_meta(job_id)
+        _task_meta_cache[job_id] = meta
+    return meta
+
+# Paths that are served without request logging and timing
+_UNLOGGED_PATHS = frozenset({"/health"})
+_UNLOGGED_PREFIXES = ("/static/", "/socket.io/")
+
 # Add middleware for request logging and timing
 @app.middleware("http")
 async def log_requests(request: Request, call_next):
-    start_time = time.time()
+    path = request.url.path
+    if path in _UNLOGGED_PATHS or path.startswith(_UNLOGGED_PREFIXES):
+        return await call_next(request)
+
+    start_ns = time.perf_counter_ns()
     
     # Process the request and get the response
     try:
         response = await call_next(request)
-        process_time = time.time() - start_time
+        process_time = (time.perf_counter_ns() - start_ns) / 1e9
         
-        # Log the request details
+        # Log the request details (formatted by loguru only if a handler accepts it)
         logger.info(
-            f"Request: {request.method} {request.url.path} "
-            f"- Status: {response.status_code} "
-            f"- Time: {process_time:.2f}s"
+            "Request: {} {} - Status: {} - Time: {:.2f}s",
+            request.method, path, response.status_code, process_time
         )
         
         # Add processing time header to the response
@@ -102,10 +156,26 @@ async def log_requests(request: Request, call_next):
             content={"detail": f"Internal server error: {str(e)}"}
         )
 
+# Tracebacks are logged at most once per exception type per interval;
+# repeats within the interval are logged as a single line
+_TRACEBACK_INTERVAL = 10.0
+_traceback_last_logged = LRUCache(maxsize=128)
+
+def _log_exception(message: str, exc: BaseException) -> None:
+    """Log an error, attaching the traceback only if this exception type hasn't logged one recently"""
+    exc_type = type(exc)
+    now = time.monotonic()
+    last = _traceback_last_logged.get(exc_type)
+    if last is None or now - last >= _TRACEBACK_INTERVAL:
+        _traceback_last_logged[exc_type] = now
+        logger.opt(exception=exc).error("{}: {}", message, exc)
+    else:
+        logger.error("{}: {}", message, exc)
+
 # Global exception handler
 @app.exception_handler(Exception)
 async def global_exception_handler(request: Request, exc: Exception):
-    logger.error(f"Unhandled exception: {str(exc)}", exc_info=True)
+    _log_exception("Unhandled exception", exc)
     return JSONResponse(
         status_code=500,
         content={
@@ -114,31 +184,53 @@ async def global_exception_handler(request: Request, exc: Exception):
         }
     )
 
+def _job_status(job_id, status, progress=0, message="", result=None, error=None):
+    """Build an AnalysisJobStatus-shaped response without Pydantic validation"""
+    return ORJSONResponse({
+        'job_id': job_id,
+        'status': status,
+        'progress': progress,
+        'message': message,
+        'result': result,
+        'error': error
+    })
+
+# Lichess usernames: 2-30 letters, digits, underscores or hyphens
+_USERNAME_MATCH = re.compile(r"[A-Za-z0-9_-]{2,30}").fullmatch
+
+def _validate_username(username: str) -> str:
+    """Return the stripped username or raise a 400 if it is not a valid Lichess username"""
+    if not username:
+        raise HTTPException(status_code=400, detail="Username is required")
+
+    # Only allocate a stripped copy when there is surrounding whitespace
+    if username[0].isspace() or username[-1].isspace():
+        username = username.strip()
+    if not _USERNAME_MATCH(username):
+        raise HTTPException(
+            status_code=400,
+            detail="Invalid username. Lichess usernames are 2 to 30 letters, digits, '_' or '-'."
+        )
+    return username
+
 # Dependency to get analysis service
 async def get_analysis_service():
     service = AnalysisService()
     yield service
 
-@sio.event
 async def connect(sid, environ):
     """Handle Socket.IO connection"""
     logger.info(f"Client connected: {sid}")
     await sio.emit('connection_established', {'status': 'connected'}, to=sid)
 
-@sio.event
 async def disconnect(sid):
     """Handle Socket.IO disconnection"""
     logger.info(f"Client disconnected: {sid}")
     
     # Clean up any subscriptions
-    for job_id, subscribers in list(websocket_connections.items()):
-        if sid in subscribers:
-            subscribers.remove(sid)
-        # Remove empty lists
-        if not subscribers:
-            websocket_connections.pop(job_id, None)
+    for job_id in list(_sio_subs):
+        _unsubscribe(_sio_subs, job_id, sid)
 
-@sio.event
 async def subscribe_to_job(sid, data):
     """Subscribe client to job updates"""
     job_id = data.get('job_id')
@@ -147,37 +239,116 @@ async def subscribe_to_job(sid, data):
         return
     
     # Add the client to the job's subscribers
-    if job_id not in websocket_connections:
-        websocket_connections[job_id] = set()
-    websocket_connections[job_id].add(sid)
+    _subscribe(_sio_subs, job_id, sid)
     
     # Send current status right away
-    job_result = AsyncResult(job_id, app=celery_app)
+    meta = _get_task_meta(job_id)
+    state = meta['status']
     status = 'pending'
     progress = 0
     
-    if job_result.ready():
-        status = 'completed' if job_result.successful() else 'failed'
-    elif job_result.state == 'PROGRESS':
+    if state in states.READY_STATES:
+        status = 'completed' if state == states.SUCCESS else 'failed'
+    elif state == 'PROGRESS':
         status = 'progress'
-        progress = job_result.info.get('progress', 0) if job_result.info else 0
+        progress = meta['result'].get('progress', 0) if meta['result'] else 0
     
-    await sio.emit('job_update', {
+    await sio.emit(_JOB_UPDATE_EVENT, {
         'job_id': job_id,
         'status': status,
         'progress': progress
     }, to=sid)
 
+def setup_socketio():
+    """Create the Socket.IO server, register its handlers and mount it on the app"""
+    global sio
+    if sio is not None:
+        return sio
+
+    import socketio
+
+    # Initialize Socket.IO for WebSocket communication
+    sio = socketio.AsyncServer(async_mode='asgi', cors_allowed_origins='*')
+    sio.on('connect', connect)
+    sio.on('disconnect', disconnect)
+    sio.on('subscribe_to_job', subscribe_to_job)
+
+    # Include the Socket.IO app in the main ASGI app routing
+    app.mount("/socket.io", socketio.ASGIApp(sio))  # Mount at standard Socket.IO path
+    return sio
+
+@app.on_event("startup")
+async def on_startup():
+    """Initialize components that are only needed once the server is running"""
+    setup_socketio()
+
+    # Capture the server loop so code running off-loop can schedule work on it
+    app.state.loop = asyncio.get_running_loop()
+
+    # Job updates raised by Celery signals are drained by a single consumer
+    app.state.job_update_queue = asyncio.Queue(maxsize=1024)
+    app.state.consumer_task = asyncio.create_task(job_update_consumer(app.state.job_update_queue))
+
+    # Subscribe to job updates on the server loop instead of a dedicated thread
+    app.state.listener_task = None
+    try:
+        import redis.asyncio as aioredis
+
+        app.state.aioredis = aioredis.from_url(REDIS_URL)
+        pubsub = app.state.aioredis.pubsub()
+        await pubsub.subscribe("job_updates")
+        app.state.listener_task = asyncio.create_task(redis_listener(pubsub))
+    except Exception as e:
+        logger.error(f"Could not start Redis listener: {str(e)}")
+
+@app.on_event("shutdown")
+async def on_shutdown():
+    """Stop background tasks started on startup"""
+    for name in ("listener_task", "consumer_task"):
+        task = getattr(app.state, name, None)
+        if task is not None:
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+    client = getattr(app.state, "aioredis", None)
+    if client is not None:
+        await client.aclose()
+
 async def send_job_updates(job_id, status, progress, message=""):
     """Send job updates to all subscribers"""
-    if job_id in websocket_connections:
-        for sid in websocket_connections[job_id]:
-            await sio.emit('job_update', {
-                'job_id': job_id,
-                'status': status,
-                'progress': progress,
-                'message': message
-            }, to=sid)
+    if status == 'completed':
+        # The worker has cached this user's analysis, so stop reporting it as missing
+        username = _job_usernames.pop(job_id, None)
+        if username is not None:
+            _analysis_misses.pop(username, None)
+
+    payload = {
+        'job_id': job_id,
+        'status': status,
+        'progress': progress,
+        'message': message
+    }
+    if sio is not None and job_id in _sio_subs:
+        # Snapshot subscribers so (un)subscribes during the fan-out don't break iteration
+        subscribers = list(_sio_subs[job_id])
+        await asyncio.gather(
+            *[sio.emit(_JOB_UPDATE_EVENT, payload, to=sid) for sid in subscribers],
+            return_exceptions=True
+        )
+    await send_ws_updates(job_id, payload)
+
+async def send_ws_updates(job_id, payload):
+    """Send a job update payload to all legacy WebSocket subscribers"""
+    if job_id in _ws_subs:
+        subscribers = list(_ws_subs[job_id])
+        # Encode once and send the same text frame to every subscriber
+        text = orjson.dumps(payload).decode()
+        await asyncio.gather(
+            *[websocket.send_text(text) for websocket in subscribers],
+            return_exceptions=True
+        )
 
 @app.websocket("/ws/analysis/{job_id}")
 async def websocket_endpoint(websocket: WebSocket, job_id: str):
@@ -186,21 +357,20 @@ async def websocket_endpoint(websocket: WebSocket, job_id: str):
     
     try:
         # Add to subscribers
-        if job_id not in websocket_connections:
-            websocket_connections[job_id] = set()
-        websocket_connections[job_id].add(websocket)
+        _subscribe(_ws_subs, job_id, websocket)
         
         # Send initial status
-        job_result = AsyncResult(job_id, app=celery_app)
+        meta = _get_task_meta(job_id)
+        state = meta['status']
         status = 'pending'
         progress = 0
         
-        if job_result.ready():
-            status = 'completed' if job_result.successful() else 'failed'
+        if state in states.READY_STATES:
+            status = 'completed' if state == states.SUCCESS else 'failed'
             progress = 100
-        elif job_result.state == 'PROGRESS' and job_result.info:
+        elif state == 'PROGRESS' and meta['result']:
             status = 'progress'
-            progress = job_result.info.get('progress', 0)
+            progress = meta['result'].get('progress', 0)
             
         await websocket.send_json({
             'job_id': job_id,
@@ -208,19 +378,18 @@ async def websocket_endpoint(websocket: WebSocket, job_id: str):
             'progress': progress
         })
         
-        # Keep connection alive until client disconnects
+        # Wait until the client disconnects; keepalive is handled by uvicorn's
+        # protocol-level ping frames, so incoming messages are simply ignored
         while True:
-            data = await websocket.receive_text()
-            # Echo any data back (just to keep connection alive)
-            if data == "ping":
-                await websocket.send_text("pong")
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                break
             
     except WebSocketDisconnect:
+        pass
+    finally:
         # Remove from subscribers when disconnected
-        if job_id in websocket_connections and websocket in websocket_connections[job_id]:
-            websocket_connections[job_id].remove(websocket)
-            if not websocket_connections[job_id]:
-                websocket_connections.pop(job_id)
+        _unsubscribe(_ws_subs, job_id, websocket)
 
 @app.post("/analyze", response_model=AnalysisJobStatus)
 async def analyze_games_async(request: AnalysisRequest):
@@ -228,21 +397,12 @@ async def analyze_games_async(request: AnalysisRequest):
     Start asynchronous analysis of chess games.
     Returns a job ID that can be used to check progress and retrieve results.
     """
+    # Validate input
+    username = _validate_username(request.username)
+
     try:
-        # Validate input
-        if not request.username:
-            raise HTTPException(status_code=400, detail="Username is required")
-        
-        username = request.username.strip()
-        if len(username) < 2 or len(username) > 30:
-            raise HTTPException(
-                status_code=400, 
-                detail="Invalid username. Lichess usernames are between 2 and 30 characters."
-            )
-        
         # Check cache first
-        cache_key = f"analysis:{username}"
-        cached_result = await cache_service.get(cache_key)
+        cached_result = await _get_cached_analysis(username, raw=True)
         
         if cached_result:
             logger.info(f"Returning cached analysis for {username}")
@@ -250,19 +410,20 @@ async def analyze_games_async(request: AnalysisRequest):
             job_id = f"cached-{uuid.uuid4()}"
             
             # Return success status with cached result
-            return AnalysisJobStatus(
+            return _job_status(
                 job_id=job_id,
                 status="completed",
                 progress=100,
                 message="Analysis retrieved from cache",
-                result=cached_result
+                result=orjson.Fragment(cached_result)
             )
             
         # Start a new analysis job
         logger.info(f"Starting new analysis job for {username}")
         task = analyze_games_task.delay(username)
+        _job_usernames[task.id] = username
         
-        return AnalysisJobStatus(
+        return _job_status(
             job_id=task.id,
             status="pending",
             progress=0,
@@ -270,7 +431,7 @@ async def analyze_games_async(request: AnalysisRequest):
         )
         
     except Exception as e:
-        logger.error(f"Error starting analysis: {str(e)}", exc_info=True)
+        _log_exception("Error starting analysis", e)
         raise HTTPException(
             status_code=500,
             detail=f"Failed to start analysis: {str(e)}"
@@ -284,7 +445,7 @@ async def get_analysis_status(job_id: str):
         if job_id.startswith("cached-"):
             # For cached results, we don't have a task to check
             # So we just return the completed status
-            return AnalysisJobStatus(
+            return _job_status(
                 job_id=job_id,
                 status="completed",
                 progress=100,
@@ -292,32 +453,33 @@ async def get_analysis_status(job_id: str):
             )
             
         # For regular tasks, check status
-        task = AsyncResult(job_id, app=celery_app)
+        meta = _get_task_meta(job_id)
+        state = meta['status']
         
-        if task.state == 'PENDING':
-            return AnalysisJobStatus(
+        if state == states.PENDING:
+            return _job_status(
                 job_id=job_id,
                 status="pending",
                 progress=0,
                 message="Analysis job is pending"
             )
             
-        elif task.state == 'PROGRESS':
-            info = task.info or {}
-            return AnalysisJobStatus(
+        elif state == 'PROGRESS':
+            info = meta['result'] or {}
+            return _job_status(
                 job_id=job_id,
                 status="progress",
                 progress=info.get('progress', 0),
                 message=info.get('status', "Analysis in progress")
             )
             
-        elif task.ready():
-            if task.successful():
-                result = task.result
+        elif state in states.READY_STATES:
+            if state == states.SUCCESS:
+                result = meta['result']
                 status = result.get('status', 'completed')
                 result_data = result.get('result')
                 
-                response = AnalysisJobStatus(
+                response = _job_status(
                     job_id=job_id,
                     status=status,
                     progress=100,
@@ -333,9 +495,9 @@ async def get_analysis_status(job_id: str):
                 return response
             else:
                 # Task failed
-                error = str(task.result) if task.result else "Unknown error"
+                error = str(meta['result']) if meta['result'] else "Unknown error"
                 
-                response = AnalysisJobStatus(
+                response = _job_status(
                     job_id=job_id,
                     status="failed",
                     progress=0,
@@ -351,7 +513,7 @@ async def get_analysis_status(job_id: str):
                 return response
         
         # Should never get here, but just in case
-        return AnalysisJobStatus(
+        return _job_status(
             job_id=job_id,
             status="unknown",
             progress=0,
@@ -359,7 +521,7 @@ async def get_analysis_status(job_id: str):
         )
             
     except Exception as e:
-        logger.error(f"Error retrieving job status: {str(e)}", exc_info=True)
+        _log_exception("Error retrieving job status", e)
         raise HTTPException(
             status_code=500,
             detail=f"Error retrieving job status: {str(e)}"
@@ -374,21 +536,12 @@ async def analyze_games_sync(
     Legacy synchronous API endpoint.
     Analyze the last 5 rapid/blitz games for a given Lichess username.
     """
+    # Validate input
+    username = _validate_username(username)
+
     try:
-        # Validate input
-        if not username:
-            raise HTTPException(status_code=400, detail="Username is required")
-        
-        username = username.strip()
-        if len(username) < 2 or len(username) > 30:
-            raise HTTPException(
-                status_code=400, 
-                detail="Invalid username. Lichess usernames are between 2 and 30 characters."
-            )
-        
         # Check cache first
-        cache_key = f"analysis:{username}"
-        cached_result = await cache_service.get(cache_key)
+        cached_result = await _get_cached_analysis(username)
         
         if cached_result:
             logger.info(f"Returning cached analysis for {username}")
@@ -397,10 +550,9 @@ async def analyze_games_sync(
         logger.info(f"Starting analysis for user: {username}")
         
         # Run the analysis - this is the original synchronous method
+        # (analyze_username caches the result itself)
         analysis = await analysis_service.analyze_username(username)
-        
-        # Cache the result
-        await cache_service.set(cache_key, analysis.model_dump())
+        _analysis_misses.pop(username, None)
         
         logger.info(f"Analysis completed for {username} in {analysis.analysis_time} seconds")
         
@@ -413,7 +565,7 @@ async def analyze_games_sync(
             detail="Stockfish engine not found. Please check server configuration."
         )
     except Exception as e:
-        logger.error(f"Error processing request: {str(e)}", exc_info=True)
+        _log_exception("Error processing request", e)
         
         # Determine the appropriate status code based on the exception
         if "not found" in str(e).lower() or "no such user" in str(e).lower():
@@ -435,9 +587,7 @@ async def health_check():
     
     # Check Redis connection through cache service
     try:
-        if hasattr(cache_service, "redis") and cache_service.redis_available:
-            cache_service.redis.ping()
-        else:
+        if not await cache_service.ping():
             redis_status = "unavailable, using memory cache"
     except Exception as e:
         redis_status = f"error: {str(e)}"
@@ -445,8 +595,7 @@ async def health_check():
     # Check Celery connection
     celery_status = "ok"
     try:
-        i = celery_app.control.inspect()
-        if not i.ping():
+        if not _inspector.ping():
             celery_status = "unavailable, tasks will fail"
     except Exception as e:
         celery_status = f"error: {str(e)}"
@@ -469,67 +618,84 @@ async def root():
     return RedirectResponse(url="/static/louts_chess_analysis.html")
 
 # Celery signal handlers
-@task_success.connect
-@task_failure.connect
 @task_postrun.connect
 def task_completion_handler(sender=None, **kwargs):
     """Handle task completion signals from Celery"""
     job_id = kwargs.get('task_id')
     state = kwargs.get('state')
     logger.debug(f"Celery task signal received: task_id={job_id}, state={state}")
+
+    # Signals fire outside the server loop (or outside the API process entirely)
+    loop = getattr(app.state, "loop", None)
+    queue = getattr(app.state, "job_update_queue", None)
+    if loop is None or queue is None:
+        return
     
     status = 'completed' if state == 'SUCCESS' else 'failed'
     progress = 100 if status == 'completed' else 0
     
-    # Send update to WebSocket clients
-    logger.debug(f"Creating async task to send job updates for job_id={job_id}, status={status}")
-    asyncio.create_task(send_job_updates(job_id, status, progress, f"Analysis {status}"))
+    # Hand the update to the server loop; job_update_consumer sends it to WebSocket clients
+    loop.call_soon_threadsafe(_enqueue_job_update, queue, (job_id, status, progress, f"Analysis {status}"))
 
-def redis_listener():
+def _enqueue_job_update(queue, update):
+    """Queue a job update, dropping it if the consumer has fallen behind"""
+    try:
+        queue.put_nowait(update)
+    except asyncio.QueueFull:
+        logger.warning(f"Job update queue full, dropping update for job_id={update[0]}")
+
+async def job_update_consumer(queue):
+    """Send queued job updates to subscribers"""
+    while True:
+        job_id, status, progress, message = await queue.get()
+        try:
+            await send_job_updates(job_id, status, progress, message)
+        except Exception as e:
+            logger.error(f"Error sending job update for job_id={job_id}: {str(e)}")
+
+async def redis_listener(pubsub):
     """Listen for Redis messages and emit updates via Socket.IO"""
+    # Track which jobs we've already processed completion for
+    completed_jobs = set()
+
     try:
-        logger.info("Starting Redis listener thread")
-        pubsub = cache_service.redis.pubsub()
-        pubsub.subscribe("job_updates")
-        
-        # Track which jobs we've already processed completion for
-        completed_jobs = set()
-        
-        for message in pubsub.listen():
-            if message["type"] == "message":
-                try:
-                    data = json.loads(message["data"])
-                    job_id = data.get("job_id")
-                    status = data.get("status")
-                    progress = data.get("progress", 0)
-                    message_text = data.get("message", "")
-                    
-                    # Skip completed status updates for jobs we've already processed
-                    if status == "completed" and job_id in completed_jobs:
-                        logger.debug(f"Skipping duplicate completion for job_id={job_id}")
-                        continue
-                        
-                    # Track completed jobs
-                    if status == "completed":
-                        completed_jobs.add(job_id)
-                    
-                    logger.info(f"Received Redis message for job_id={job_id}, status={status}, progress={progress}")
+        logger.info("Starting Redis listener")
+        async for message in pubsub.listen():
+            if message["type"] != "message":
+                continue
+            try:
+                data = orjson.loads(message["data"])
+                job_id = data.get("job_id")
+                status = data.get("status")
+                progress = data.get("progress", 0)
+                message_text = data.get("message", "")
+                
+                # Skip completed status updates for jobs we've already processed
+                if status == "completed" and job_id in completed_jobs:
+                    logger.debug(f"Skipping duplicate completion for job_id={job_id}")
+                    continue
                     
-                    # Emit the update to all connected clients
-                    asyncio.run(send_job_updates(job_id, status, progress, message_text))
-                except json.JSONDecodeError:
-                    logger.error(f"Invalid JSON in Redis message: {message['data']}")
-                except Exception as e:
-                    logger.error(f"Error processing Redis message: {str(e)}")
+                # Track completed jobs
+                if status == "completed":
+                    completed_jobs.add(job_id)
                 
+                logger.info(f"Received Redis message for job_id={job_id}, status={status}, progress={progress}")
+                
+                # Emit the update to all connected clients
+                await send_job_updates(job_id, status, progress, message_text)
+            except orjson.JSONDecodeError:
+                logger.error(f"Invalid JSON in Redis message: {message['data']}")
+            except Exception as e:
+                logger.error(f"Error processing Redis message: {str(e)}")
+                
+    except asyncio.CancelledError:
+        raise
     except Exception as e:
-        logger.error(f"Error in Redis listener: {str(e)}", exc_info=True)
-
-# Start the Redis listener in a separate thread
-listener_thread = threading.Thread(target=redis_listener, daemon=True)
-listener_thread.start()
+        _log_exception("Error in Redis listener", e)
 
 # Run the application directly when this file is executed
 if __name__ == "__main__":
+    import uvicorn
+
     logger.info(f"Starting Lotus Chess Analysis Service on {API_HOST}:{API_PORT}")
-    uvicorn.run(app, host=API_HOST, port=API_PORT, reload=False)
+    uvicorn.run(app, host=API_HOST, port=API_PORT, reload=False, ws_ping_interval=20, ws_ping_timeout=20)
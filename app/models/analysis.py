@@ -1,25 +1,33 @@
-from pydantic import BaseModel
-from typing import List, Optional, Dict, Any, Union
+from pydantic import BaseModel, ConfigDict, SkipValidation, StrictFloat
+from typing import Annotated, List, Optional, Dict, Any, Union
 from datetime import datetime
 
 
 class MoveAnalysis(BaseModel):
     """Represents analysis of a single chess move."""
+    model_config = ConfigDict(frozen=True, extra='forbid')
+
     move: str
-    eval: float
+    eval: StrictFloat
 
 
 class PositionAnalysis(BaseModel):
     """Represents analysis of a chess position."""
+    model_config = ConfigDict(frozen=True, extra='forbid')
+
     fen: str
     move_number: int
     played_move: str
+    # 0.0 when there is no evaluation: a forced move, a timed-out search,
+    # or a played move outside best_moves
     played_move_eval: float
     best_moves: List[MoveAnalysis]
 
 
 class GameAnalysis(BaseModel):
     """Represents analysis of a complete chess game."""
+    model_config = ConfigDict(frozen=True, extra='forbid')
+
     game_id: str
     time_control: str
     moves: List[PositionAnalysis]
@@ -27,6 +35,8 @@ class GameAnalysis(BaseModel):
 
 class AnalysisResponse(BaseModel):
     """Represents the complete analysis response."""
+    model_config = ConfigDict(frozen=True, extra='forbid')
+
     games: List[GameAnalysis]
     analysis_time: float
 
@@ -42,7 +52,7 @@ class AnalysisJobStatus(BaseModel):
     status: str  # "pending", "progress", "completed", "failed"
     progress: int = 0  # 0-100 progress percentage
     message: str = ""
-    result: Optional[Dict[str, Any]] = None
+    result: Annotated[Optional[Dict[str, Any]], SkipValidation] = None  # already-validated analysis dict
     error: Optional[str] = None
 
 
@@ -2,35 +2,51 @@
 Enhanced Analysis Service with caching and optimized parallelization
 """
 import asyncio
+import threading
 import time
 import logging
 import chess
 import chess.engine
-from typing import List, Dict, Any, Tuple, Optional, Callable
+from chess.polyglot import zobrist_hash
+from typing import List, Dict, Any, Tuple, Optional, Callable, AsyncIterator
+from contextlib import asynccontextmanager
 import os
 from pathlib import Path
 from concurrent.futures import ThreadPoolExecutor
 from functools import partial
+from itertools import islice
+from cachetools import LRUCache
 
 from app.models.analysis import GameAnalysis, PositionAnalysis, MoveAnalysis, AnalysisResponse
 from app.services.lichess_service import LichessService
 from app.services.cache_service import CacheService
-from app.config import STOCKFISH_PATH, ANALYSIS_TIME, ANALYSIS_DEPTH, CANDIDATE_MOVES, MAX_GAMES
+from app.config import (
+    get_stockfish_path, ANALYSIS_TIME, ANALYSIS_DEPTH, CANDIDATE_MOVES, MAX_GAMES, TT_ENTRIES,
+    ENGINE_POOL_SIZE, ENGINE_HASH_MB, ENGINE_THREADS, SHALLOW_DEPTH, CLEAR_MOVE_MARGIN
+)
 
 logger = logging.getLogger(__name__)
 
 
+def _forced_move(board: chess.Board) -> Optional[chess.Move]:
+    """Return the only legal move in a position, or None if there is a choice"""
+    # Generating two legal moves is enough to tell, rather than all of them
+    legal_moves = list(islice(board.legal_moves, 2))
+    return legal_moves[0] if len(legal_moves) == 1 else None
+
+
 class AnalysisService:
     def __init__(self):
         self.lichess_service = LichessService()
         self.cache_service = CacheService()
-        self.engine_path = STOCKFISH_PATH
+        self.engine_path = get_stockfish_path()
         self.analysis_time = ANALYSIS_TIME
         self.analysis_depth = ANALYSIS_DEPTH
         self.candidates = CANDIDATE_MOVES
-        self.engine_pool = []
-        self.engine_semaphore = asyncio.Semaphore(8)  # Limit concurrent engine usage
-        self.position_cache = {}  # In-memory position cache for identical positions
+        self.engines: asyncio.Queue = asyncio.Queue()  # Idle engines; its size bounds concurrent engine usage
+        # Bounded position cache: Zobrist hash -> best_moves
+        self.position_cache: LRUCache = LRUCache(maxsize=TT_ENTRIES)
+        self._position_cache_lock = threading.Lock()
         self._progress_callback = None
 
         # Make sure engine file exists
@@ -66,15 +82,14 @@ class AnalysisService:
 
         try:
             # Check if we have cached results for this username
-            cache_key = f"analysis:{username}"
-            cached_result = await self.cache_service.get(cache_key)
+            cached_result = await self.cache_service.get_analysis(username)
             
             if cached_result:
                 logger.info(f"Using cached analysis for {username}")
                 return AnalysisResponse(**cached_result)
 
             # Initialize the engine pool
-            await self.init_engine_pool(num_engines=8)
+            await self.init_engine_pool(num_engines=ENGINE_POOL_SIZE)
             logger.info("Engine pool initialized")
                 
             # Report progress
@@ -94,30 +109,83 @@ class AnalysisService:
             # Report progress
             self._report_progress(10, 100, f"Found {len(games)} games to analyze")
             
+            # Reuse games stored by an earlier run that didn't finish
+            stored_games = await self.cache_service.get_game_analyses(
+                username, [game["game_id"] for game in games]
+            )
+            if stored_games:
+                logger.info(f"Reusing {len(stored_games)} previously analyzed games for {username}")
+            pending_games = [game for game in games if game["game_id"] not in stored_games]
+            
+            # Planning pass: group each game's positions by Zobrist hash
+            plans = [self._plan_game(game) for game in pending_games]
+            
+            # Collect the unique positions of all games, remembering the first
+            # instance of each and how many moves were played from it
+            positions = {}
+            move_counts = {}
+            for game, plan in zip(pending_games, plans):
+                for key, (board, moves_with_key) in plan.items():
+                    if key not in positions:
+                        positions[key] = (game["game_id"], board, moves_with_key[0])
+                        move_counts[key] = 0
+                    move_counts[key] += len(moves_with_key)
+            
             # Calculate total positions to analyze for progress reporting
-            total_positions = sum(len(game.get("moves", [])) for game in games)
+            total_positions = sum(move_counts.values())
             positions_analyzed = 0
 
-            # Analyze all games in parallel
-            analyzed_games = []
-            
-            # Create progress tracking function for positions
-            async def analyze_and_track(game):
+            def track_progress(keys: List[int]) -> None:
                 nonlocal positions_analyzed
-                result = await self._analyze_game(game)
-                positions_analyzed += len(game.get("moves", []))
+                positions_analyzed += sum(move_counts[key] for key in keys)
                 progress = min(10 + int(90 * positions_analyzed / total_positions), 99)
                 self._report_progress(progress, 100, f"Analyzed {positions_analyzed}/{total_positions} positions")
-                return result
-
-            # Process games in parallel with a maximum batch size to avoid overwhelming the system
-            batch_size = min(len(games), 3)  # Process up to 3 games simultaneously
-            for i in range(0, len(games), batch_size):
-                batch = games[i:i + batch_size]
-                batch_results = await asyncio.gather(
-                    *[analyze_and_track(game) for game in batch]
-                )
-                analyzed_games.extend(batch_results)
+
+            # Track the positions each game still waits on, so it can be assembled
+            # and stored as soon as its last one completes
+            remaining = [len(plan) for plan in plans]
+            games_by_key = {}
+            for index, plan in enumerate(plans):
+                for key in plan:
+                    games_by_key.setdefault(key, []).append(index)
+            new_games = {}
+            store_tasks = []
+
+            def finish_games(indices: List[int], analyses: Dict[int, List[MoveAnalysis]]) -> None:
+                # Assembly pass: build each game's analysis from the shared results, and
+                # store it on its own so a run that fails later can reuse it
+                finished = []
+                for index in indices:
+                    game = pending_games[index]
+                    new_games[game["game_id"]] = self._assemble_game(game, plans[index], analyses)
+                    finished.append(new_games[game["game_id"]].model_dump())
+                if finished:
+                    store_tasks.append(asyncio.create_task(
+                        self.cache_service.set_game_analyses(username, finished)
+                    ))
+
+            def on_analyzed(keys: List[int], analyses: Dict[int, List[MoveAnalysis]]) -> None:
+                track_progress(keys)
+                completed = []
+                for key in keys:
+                    for index in games_by_key[key]:
+                        remaining[index] -= 1
+                        if not remaining[index]:
+                            completed.append(index)
+                finish_games(completed, analyses)
+
+            # Games without positions to analyze are complete already
+            finish_games([index for index, count in enumerate(remaining) if not count], {})
+
+            # Analyze the positions of every game at once, so the engine pool stays
+            # saturated rather than idling while the last positions of a game finish
+            await self._analyze_positions(positions, on_analyzed)
+            await asyncio.gather(*store_tasks)
+            
+            analyzed_games = [
+                new_games.get(game["game_id"]) or GameAnalysis.model_validate(stored_games[game["game_id"]])
+                for game in games
+            ]
 
             analysis_time = round(time.time() - start_time, 2)
             
@@ -127,8 +195,8 @@ class AnalysisService:
                 analysis_time=analysis_time
             )
             
-            # Cache the result
-            await self.cache_service.set(cache_key, response.model_dump())
+            # Cache the result; the games are already stored, so this only writes the index
+            await self.cache_service.set_analysis(username, response.model_dump(), store_games=False)
             
             # Final progress update
             self._report_progress(100, 100, "Analysis complete")
@@ -145,41 +213,43 @@ class AnalysisService:
     async def cleanup(self):
         """Clean up resources"""
         # Clean up the engine pool
-        for engine in self.engine_pool:
+        while not self.engines.empty():
+            engine = self.engines.get_nowait()
             try:
                 await engine.quit()
             except Exception as e:
                 logger.error(f"Error closing chess engine: {str(e)}")
-        self.engine_pool = []
         
         # Close the lichess service
         await self.lichess_service.close()
+        
+        # Close the Redis client, which is bound to this event loop
+        await self.cache_service.close()
 
     async def init_engine(self) -> chess.engine.UciProtocol:
         """Initialize and return a chess engine"""
         transport, engine = await chess.engine.popen_uci(self.engine_path)
+        # The engine stays up for the whole run and analyse() never sends ucinewgame,
+        # so its hash table carries over between positions. Ponder is managed by
+        # python-chess and is off for analyse()
+        await engine.configure({"Hash": ENGINE_HASH_MB, "Threads": ENGINE_THREADS})
         return engine
 
     async def init_engine_pool(self, num_engines: int = 8) -> None:
         """Initialize a pool of chess engines"""
         for _ in range(num_engines):
-            engine = await self.init_engine()
-            self.engine_pool.append(engine)
-        logger.info(f"Initialized pool of {len(self.engine_pool)} engines")
-
-    async def get_engine_from_pool(self) -> chess.engine.UciProtocol:
-        """Get an engine from the pool or create a new one if needed"""
-        await self.engine_semaphore.acquire()
-        if not self.engine_pool:
-            # If pool is empty, create a new engine
-            return await self.init_engine()
-        return self.engine_pool.pop()
-
-    async def release_engine_to_pool(self, engine: chess.engine.UciProtocol) -> None:
-        """Release an engine back to the pool"""
-        if engine:
-            self.engine_pool.append(engine)
-            self.engine_semaphore.release()
+            self.engines.put_nowait(await self.init_engine())
+        logger.info(f"Initialized pool of {self.engines.qsize()} engines")
+
+    @asynccontextmanager
+    async def _acquire_engine(self) -> AsyncIterator[chess.engine.UciProtocol]:
+        """Check an engine out of the pool for the duration of the block, waiting if none is idle"""
+        engine = await self.engines.get()
+        try:
+            yield engine
+        finally:
+            # Release the engine back to the pool
+            self.engines.put_nowait(engine)
 
     def _report_progress(self, current: int, total: int, status: str) -> None:
         """Report progress to callback if registered"""
@@ -189,78 +259,136 @@ class AnalysisService:
             except Exception as e:
                 logger.error(f"Error in progress callback: {str(e)}")
 
-    async def _analyze_game(self, game: Dict) -> GameAnalysis:
-        """Analyze a single game by analyzing positions in parallel"""
+    def _plan_game(self, game: Dict) -> Dict[int, Tuple[chess.Board, List[Dict]]]:
+        """Group a game's moves by the Zobrist hash of the position they were played from"""
+        # Keep a board of the first instance of each position for the engine
+        position_groups = {}
         try:
-            analyzed_positions = []
-            if "moves" in game and game["moves"]:
-                # Create FEN cache for this game to avoid duplicate analysis
-                game_cache = {}
-                position_tasks = []
-                
-                # Group positions by their FEN to avoid analyzing duplicates
-                fen_groups = {}
-                for move_data in game["moves"]:
-                    fen = move_data["fen"]
-                    if fen not in fen_groups:
-                        fen_groups[fen] = []
-                    fen_groups[fen].append(move_data)
-                
-                # Create a task for each unique FEN position
-                for fen, moves_with_fen in fen_groups.items():
-                    # Check if this position has been analyzed before in any game
-                    if fen in self.position_cache:
-                        # Reuse cached analysis for all instances of this FEN
-                        result = self.position_cache[fen]
-                        for move_data in moves_with_fen:
-                            # Create position analysis but update move-specific data
-                            pos_analysis = PositionAnalysis(
-                                fen=fen,
-                                move_number=move_data["move_number"],
-                                played_move=move_data["played_move"],
-                                played_move_eval=result["played_move_eval"],
-                                best_moves=result["best_moves"]
-                            )
-                            game_cache[move_data["move_number"]] = pos_analysis
+            # Games carry SAN moves (always from PGN), UCI moves, or both
+            moves_san = game.get("moves_san")
+            moves = moves_san or game.get("moves_uci")
+            if moves:
+                # Replay the game from its starting position, which is cheaper than
+                # storing and re-parsing a FEN for every move
+                board = chess.Board(game["start_fen"])
+                parse = board.parse_san if moves_san else board.parse_uci
+                for i, notation in enumerate(moves):
+                    move = parse(notation)
+                    fen = board.fen()
+                    key = zobrist_hash(board)
+                    if key not in position_groups:
+                        position_groups[key] = (board.copy(stack=False), [])
+                    
+                    # Derive SAN while replaying if the game was parsed without it
+                    if moves_san:
+                        move_san = moves_san[i]
+                        board.push(move)
                     else:
-                        # Only analyze the first instance of this FEN
-                        position_tasks.append(self._analyze_position_with_engine(moves_with_fen[0], game["game_id"]))
-                
-                # Run all position analyses in parallel
-                if position_tasks:
-                    batch_results = await asyncio.gather(*position_tasks, return_exceptions=True)
+                        move_san = board.san_and_push(move)
                     
-                    # Process results
-                    for i, result in enumerate(batch_results):
-                        if isinstance(result, Exception):
-                            logger.error(f"Error analyzing position in game {game['game_id']}: {str(result)}")
-                            continue
-                        
-                        # Extract the analyzed position and its data
-                        fen = result.fen
-                        
-                        # Store in cache for future reuse
-                        self.position_cache[fen] = {
-                            "played_move_eval": result.played_move_eval,
-                            "best_moves": result.best_moves
-                        }
-                        
-                        # Apply analysis to all positions with this FEN
-                        for move_data in fen_groups[fen]:
-                            pos_analysis = PositionAnalysis(
-                                fen=fen,
-                                move_number=move_data["move_number"],
-                                played_move=move_data["played_move"],
-                                played_move_eval=result.played_move_eval,
-                                best_moves=result.best_moves
-                            )
-                            game_cache[move_data["move_number"]] = pos_analysis
-                
-                # Convert the game_cache into a sorted list of positions
-                analyzed_positions = [game_cache[move_num] for move_num in sorted(game_cache.keys())]
+                    position_groups[key][1].append({
+                        "move_number": i + 1,
+                        "fen": fen,
+                        "played_move": move_san
+                    })
             else:
                 logger.warning(f"No moves found in game {game['game_id']}")
 
+        except Exception as e:
+            logger.error(f"Error reading positions of game {game['game_id']}: {str(e)}")
+            # Leave the game out of the analysis; it is returned without moves
+            position_groups = {}
+        return position_groups
+
+    async def _analyze_positions(self, positions: Dict[int, Tuple[str, chess.Board, Dict]],
+                                 on_analyzed: Callable[[List[int], Dict[int, List[MoveAnalysis]]], None]
+                                 ) -> Dict[int, List[MoveAnalysis]]:
+        """Analyze unique positions, keyed by Zobrist hash, reusing earlier analyses where possible
+        
+        positions maps each hash to (game_id, board, move_data) of its first instance;
+        on_analyzed is called with the hashes of each batch of positions that completes,
+        and the analyses so far.
+        """
+        analyses = {}
+        
+        # Reuse analyses of positions seen before in any game
+        uncached_keys = []
+        for key in positions:
+            with self._position_cache_lock:
+                cached = self.position_cache.get(key)
+            if cached is not None:
+                analyses[key] = cached
+            else:
+                uncached_keys.append(key)
+        
+        # Look up the remaining positions in the shared transposition table
+        # (one HMGET, shared across users and workers)
+        position_keys = []
+        if uncached_keys:
+            shared = await self.cache_service.get_positions(uncached_keys)
+            for key in uncached_keys:
+                data = shared.get(key)
+                if data is None:
+                    position_keys.append(key)
+                    continue
+                
+                best_moves = [MoveAnalysis(move=move, eval=eval_score) for move, eval_score in data]
+                with self._position_cache_lock:
+                    self.position_cache[key] = best_moves
+                analyses[key] = best_moves
+        
+        if analyses:
+            on_analyzed(list(analyses), analyses)
+        
+        # Run all engine analyses in parallel; the engine pool bounds how many run at once
+        if position_keys:
+            async def analyze(key):
+                game_id, board, move_data = positions[key]
+                try:
+                    return key, await self._analyze_position_with_engine(move_data, game_id, board)
+                except Exception as e:
+                    return key, e
+            
+            # Process results as each one finishes, so progress and the in-process
+            # cache advance position by position
+            new_entries = {}
+            for next_result in asyncio.as_completed([analyze(key) for key in position_keys]):
+                key, result = await next_result
+                if isinstance(result, Exception):
+                    logger.error(f"Error analyzing position in game {positions[key][0]}: {str(result)}")
+                    on_analyzed([key], analyses)
+                    continue
+                
+                # Store in cache for future reuse
+                with self._position_cache_lock:
+                    self.position_cache[key] = result.best_moves
+                # Don't share timed-out or failed analyses, nor forced moves, whose
+                # eval is a placeholder rather than an engine result
+                if result.best_moves and _forced_move(positions[key][1]) is None:
+                    new_entries[key] = [(move.move, move.eval) for move in result.best_moves]
+                analyses[key] = result.best_moves
+                on_analyzed([key], analyses)
+            
+            # Write the new analyses to the shared transposition table
+            await self.cache_service.set_positions(new_entries)
+        
+        return analyses
+
+    def _assemble_game(self, game: Dict, position_groups: Dict[int, Tuple[chess.Board, List[Dict]]],
+                       analyses: Dict[int, List[MoveAnalysis]]) -> GameAnalysis:
+        """Build a game's analysis from the analyses of its positions"""
+        try:
+            # Move numbers run 1..N, so each position has a fixed slot and no sort is needed
+            analyzed_positions = [None] * len(game.get("moves_san") or game.get("moves_uci") or [])
+            for key, (_, moves_with_key) in position_groups.items():
+                best_moves = analyses.get(key)
+                if best_moves is not None:
+                    # Apply analysis to all positions with this hash
+                    self._apply_position_analysis(analyzed_positions, moves_with_key, best_moves)
+            
+            # Drop positions whose analysis failed
+            analyzed_positions = [position for position in analyzed_positions if position is not None]
+
             return GameAnalysis(
                 game_id=game["game_id"],
                 time_control=game["time_control"],
@@ -276,30 +404,68 @@ class AnalysisService:
                 moves=[]
             )
 
-    async def _analyze_position(self, engine: chess.engine.UciProtocol, move_data: Dict) -> PositionAnalysis:
-        """Analyze a single chess position"""
+    def _apply_position_analysis(self, analyzed_positions: List[Optional[PositionAnalysis]], moves: List[Dict],
+                                 best_moves: List[MoveAnalysis]) -> None:
+        """Record one position's analysis for every move played from that position"""
+        candidate_evals = {move.move: move.eval for move in best_moves}
+        for move_data in moves:
+            # Only move-specific data differs, and the analysis was validated when
+            # first produced, so skip re-validation
+            analyzed_positions[move_data["move_number"] - 1] = PositionAnalysis.model_construct(
+                fen=move_data["fen"],
+                move_number=move_data["move_number"],
+                played_move=move_data["played_move"],
+                played_move_eval=candidate_evals.get(move_data["played_move"], 0.0),
+                best_moves=best_moves
+            )
+
+    async def _candidate_moves(self, engine: chess.engine.UciProtocol, board: chess.Board,
+                               limit: chess.engine.Limit) -> List[MoveAnalysis]:
+        """Search a position and return its top candidate moves, best first"""
+        analysis_result = await asyncio.wait_for(
+            engine.analyse(board, limit, multipv=self.candidates),
+            timeout=self.analysis_time + 2.0  # Add a buffer to the timeout
+        )
+
+        best_moves = []
+        for pv in analysis_result:
+            if "pv" in pv and len(pv["pv"]) > 0:
+                move = pv["pv"][0]
+                # Centipawns to pawns; mate scores become +/-100 by sign
+                score = pv["score"].relative
+                centipawns = score.score()
+                if centipawns is not None:
+                    eval_score = centipawns / 100.0
+                else:
+                    eval_score = 100.0 if score.mate() > 0 else -100.0
+                best_moves.append(
+                    MoveAnalysis(move=board.san(move), eval=eval_score)
+                )
+        return best_moves
+
+    async def _analyze_position(self, engine: chess.engine.UciProtocol, move_data: Dict,
+                                board: chess.Board) -> PositionAnalysis:
+        """Analyze a single chess position, given its already-parsed board"""
         try:
             fen = move_data["fen"]
-            board = chess.Board(fen)
-
-            # Set up analysis parameters with both time and depth limits
-            limit = chess.engine.Limit(time=self.analysis_time, depth=self.analysis_depth)
 
             # Get top N candidate moves with timeout
             try:
-                analysis_result = await asyncio.wait_for(
-                    engine.analyse(board, limit, multipv=self.candidates),
-                    timeout=self.analysis_time + 2.0  # Add a buffer to the timeout
+                # Search shallowly first, and only spend the full time and depth
+                # budget when the top two moves are too close to call
+                best_moves = await self._candidate_moves(
+                    engine, board, chess.engine.Limit(depth=SHALLOW_DEPTH)
                 )
-
-                best_moves = []
-                for pv in analysis_result:
-                    if "pv" in pv and len(pv["pv"]) > 0:
-                        move = pv["pv"][0]
-                        eval_score = self._normalize_evaluation(pv["score"].relative)
-                        best_moves.append(
-                            MoveAnalysis(move=board.san(move), eval=eval_score)
+                if len(best_moves) > 1 and abs(best_moves[0].eval - best_moves[1].eval) <= CLEAR_MOVE_MARGIN:
+                    # Set up analysis parameters with both time and depth limits;
+                    # if the deep search times out, keep the shallow candidates
+                    try:
+                        best_moves = await self._candidate_moves(
+                            engine, board, chess.engine.Limit(time=self.analysis_time, depth=self.analysis_depth)
                         )
+                    except asyncio.TimeoutError:
+                        logger.warning(f"Deep analysis timed out for position at move {move_data['move_number']}, "
+                                       f"using the shallow search")
 
                 # Evaluate the played move
                 played_move_eval = None
@@ -344,37 +510,25 @@ class AnalysisService:
             )
 
 
-    async def _analyze_position_with_engine(self, move_data: Dict, game_id: str) -> PositionAnalysis:
+    async def _analyze_position_with_engine(self, move_data: Dict, game_id: str,
+                                            board: chess.Board) -> PositionAnalysis:
         """Get an engine from the pool, analyze a position, and release the engine back to the pool"""
-        engine = None
-        try:
-            # Check if we've already analyzed this position in this game
-            fen = move_data["fen"]
-            
-            # Get an engine from the pool
-            engine = await self.get_engine_from_pool()
+        # Forced moves need no search, so don't tie up an engine for them.
+        # They carry no evaluation, reported as 0.0 like any unavailable eval
+        forced_move = _forced_move(board)
+        if forced_move is not None:
+            return PositionAnalysis(
+                fen=move_data["fen"],
+                move_number=move_data["move_number"],
+                played_move=move_data["played_move"],
+                played_move_eval=0.0,
+                best_moves=[MoveAnalysis(move=board.san(forced_move), eval=0.0)]
+            )
 
-            # Analyze the position
-            result = await self._analyze_position(engine, move_data)
-            return result
+        try:
+            async with self._acquire_engine() as engine:
+                return await self._analyze_position(engine, move_data, board)
 
         except Exception as e:
             logger.error(f"Error in _analyze_position_with_engine for move {move_data['move_number']} in game {game_id}: {str(e)}")
             raise
-        finally:
-            # Release the engine back to the pool
-            if engine:
-                try:
-                    await self.release_engine_to_pool(engine)
-                except Exception as e:
-                    logger.error(f"Error releasing engine to pool: {str(e)}")
-
-    def _normalize_evaluation(self, score) -> float:
-        """Convert a chess.engine score to a floating point value"""
-        if score.is_mate():
-            # Convert mate score to a large value with sign
-            mate_score = 100.0 if score.mate() > 0 else -100.0
-            return mate_score
-        else:
-            # Convert centipawns to pawns
-            return score.score() / 100.0
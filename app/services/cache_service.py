@@ -1,40 +1,137 @@
 """
 Cache service for storing and retrieving analysis results
 """
-import redis
-import json
+import redis.asyncio as aioredis
+import orjson
 import logging
-import hashlib
-from typing import Dict, Any, Optional
+import threading
+import xxhash
+import zstandard
+from typing import Dict, Any, List, Optional, Tuple
 from cachetools import TTLCache
 import asyncio
 
-from app.config import REDIS_HOST, REDIS_PORT, REDIS_DB, CACHE_TIMEOUT
+from app.config import REDIS_HOST, REDIS_PORT, REDIS_DB, CACHE_TIMEOUT, POSITION_CACHE_TIMEOUT
 
 logger = logging.getLogger(__name__)
 
+# Payloads at least this large are zstd-compressed before going to Redis
+COMPRESS_MIN_BYTES = 1024
+_ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+
+# Payloads at least this large are (de)serialized in a worker thread so they
+# don't stall the event loop; below it the thread hop costs more than it saves
+OFFLOAD_MIN_BYTES = 64 * 1024
+
+# zstd contexts aren't safe to share between threads, so each thread gets its own
+_zstd = threading.local()
+
+
+def _compressor() -> zstandard.ZstdCompressor:
+    if not hasattr(_zstd, "compressor"):
+        _zstd.compressor = zstandard.ZstdCompressor(level=3)
+    return _zstd.compressor
+
+
+def _decompressor() -> zstandard.ZstdDecompressor:
+    if not hasattr(_zstd, "decompressor"):
+        _zstd.decompressor = zstandard.ZstdDecompressor()
+    return _zstd.decompressor
+
+# Redis hash holding position analyses shared by all workers, keyed by Zobrist hash
+POSITION_TABLE_KEY = "lotus_chess:tt"
+
+# A shared position analysis: its candidate moves, [(move_san, eval), ...]
+PositionEntry = List[Tuple[str, float]]
+
+
+def _encode(value: Any) -> bytes:
+    """Serialize a value to JSON, compressing it if it is large"""
+    data = orjson.dumps(value)
+    if len(data) >= COMPRESS_MIN_BYTES:
+        return _compressor().compress(data)
+    return data
+
+
+def _decompress(data: bytes) -> bytes:
+    """Return the JSON bytes of a stored payload, which may or may not be compressed"""
+    if data[:4] == _ZSTD_MAGIC:
+        return _decompressor().decompress(data)
+    return data
+
+
+def _decode(data: bytes) -> Any:
+    """Deserialize a stored payload"""
+    return orjson.loads(_decompress(data))
+
+
+async def _run_offloaded(func, data: bytes):
+    """Run func(data), in a worker thread if the payload is large"""
+    if len(data) >= OFFLOAD_MIN_BYTES:
+        return await asyncio.to_thread(func, data)
+    return func(data)
+
+
+def _analysis_key(username: str) -> str:
+    return f"analysis:{username}"
+
+
+def _game_key(username: str, game_id: str) -> str:
+    return f"analysis:{username}:{game_id}"
+
+
 class CacheService:
     def __init__(self):
         # Set up in-memory cache as a fallback
         self.memory_cache = TTLCache(maxsize=100, ttl=CACHE_TIMEOUT)
-        self.lock = asyncio.Lock()
         
-        # Try to connect to Redis
-        try:
-            self.redis = redis.Redis(
-                host=REDIS_HOST,
-                port=REDIS_PORT,
-                db=REDIS_DB,
-                socket_timeout=2,
-                decode_responses=True
-            )
-            # Test connection
-            self.redis.ping()
-            self.redis_available = True
-            logger.info("Redis cache service initialized successfully")
-        except Exception as e:
+        # Redis is connected lazily, since the async client needs a running event loop
+        self.redis = None
+        self.redis_available = False
+        self._redis_checked = False
+        self._connect_lock = asyncio.Lock()
+
+    async def _ensure_redis(self) -> bool:
+        """Connect to Redis on first use; returns whether Redis is available"""
+        if self._redis_checked:
+            return self.redis_available
+        
+        async with self._connect_lock:
+            if self._redis_checked:
+                return self.redis_available
+            
+            # Try to connect to Redis
+            try:
+                self.redis = aioredis.Redis(
+                    host=REDIS_HOST,
+                    port=REDIS_PORT,
+                    db=REDIS_DB,
+                    socket_timeout=2  # values are raw JSON bytes, decoded by orjson
+                )
+                # Test connection
+                await self.redis.ping()
+                self.redis_available = True
+                logger.info("Redis cache service initialized successfully")
+            except Exception as e:
+                self.redis_available = False
+                logger.warning(f"Redis connection failed, using in-memory cache instead: {str(e)}")
+            self._redis_checked = True
+            return self.redis_available
+
+    async def ping(self) -> bool:
+        """Ping Redis; returns False if the service is running on the memory cache"""
+        if not await self._ensure_redis():
+            return False
+        await self.redis.ping()
+        return True
+
+    async def close(self) -> None:
+        """Close the Redis client; the next use reconnects"""
+        if self.redis is not None:
+            await self.redis.aclose()
+            self.redis = None
             self.redis_available = False
-            logger.warning(f"Redis connection failed, using in-memory cache instead: {str(e)}")
+            self._redis_checked = False
 
     async def get(self, key: str) -> Optional[Dict[str, Any]]:
         """Get a value from cache"""
@@ -43,17 +140,40 @@ class CacheService:
         
         try:
             # Try Redis first if available
-            if self.redis_available:
-                data = self.redis.get(cache_key)
+            if await self._ensure_redis():
+                data = await self.redis.get(cache_key)
                 if data:
                     logger.debug(f"Cache hit for key: {cache_key[:16]}...")
-                    return json.loads(data)
+                    return await _run_offloaded(_decode, data)
                     
             # Fall back to memory cache
-            async with self.lock:
-                if cache_key in self.memory_cache:
-                    logger.debug(f"Memory cache hit for key: {cache_key[:16]}...")
-                    return self.memory_cache[cache_key]
+            value = self.memory_cache.get(cache_key)
+            if value is not None:
+                logger.debug(f"Memory cache hit for key: {cache_key[:16]}...")
+                return value
+                    
+            logger.debug(f"Cache miss for key: {cache_key[:16]}...")
+            return None
+            
+        except Exception as e:
+            logger.error(f"Error retrieving from cache: {str(e)}")
+            return None
+            
+    async def get_raw(self, key: str) -> Optional[bytes]:
+        """Get a value from cache as its serialized JSON bytes"""
+        cache_key = self._normalize_key(key)
+        
+        try:
+            if await self._ensure_redis():
+                data = await self.redis.get(cache_key)
+                if data:
+                    logger.debug(f"Cache hit for key: {cache_key[:16]}...")
+                    return await _run_offloaded(_decompress, data)
+                    
+            value = self.memory_cache.get(cache_key)
+            if value is not None:
+                logger.debug(f"Memory cache hit for key: {cache_key[:16]}...")
+                return orjson.dumps(value)
                     
             logger.debug(f"Cache miss for key: {cache_key[:16]}...")
             return None
@@ -62,28 +182,178 @@ class CacheService:
             logger.error(f"Error retrieving from cache: {str(e)}")
             return None
             
+    async def get_many(self, keys: List[str], raw: bool = False) -> Dict[str, Any]:
+        """Get several values from cache in one round-trip (as JSON bytes if raw); missing keys are omitted"""
+        results = {}
+        if not keys:
+            return results
+        cache_keys = [self._normalize_key(key) for key in keys]
+        
+        try:
+            # Try Redis first if available
+            if await self._ensure_redis():
+                values = await self.redis.mget(cache_keys)
+                for key, data in zip(keys, values):
+                    if data:
+                        results[key] = await _run_offloaded(_decompress if raw else _decode, data)
+                        
+            # Fall back to memory cache for anything Redis didn't have
+            for key, cache_key in zip(keys, cache_keys):
+                if key not in results:
+                    value = self.memory_cache.get(cache_key)
+                    if value is not None:
+                        results[key] = orjson.dumps(value) if raw else value
+                        
+            logger.debug(f"Cache hits for {len(results)}/{len(keys)} keys")
+            
+        except Exception as e:
+            logger.error(f"Error retrieving from cache: {str(e)}")
+        return results
+            
     async def set(self, key: str, value: Dict[str, Any]) -> None:
         """Store a value in cache"""
         # Normalize the key
         cache_key = self._normalize_key(key)
         
         try:
-            # Store as JSON string
-            data = json.dumps(value)
+            # Store as (possibly compressed) JSON bytes
+            data = _encode(value)
             
             # Store in Redis if available
-            if self.redis_available:
-                self.redis.setex(cache_key, CACHE_TIMEOUT, data)
+            if await self._ensure_redis():
+                await self.redis.setex(cache_key, CACHE_TIMEOUT, data)
                 
             # Also store in memory cache as backup
-            async with self.lock:
-                self.memory_cache[cache_key] = value
+            self.memory_cache[cache_key] = value
                 
             logger.debug(f"Cached data for key: {cache_key[:16]}...")
             
         except Exception as e:
             logger.error(f"Error storing in cache: {str(e)}")
     
+    async def set_many(self, items: Dict[str, Dict[str, Any]]) -> None:
+        """Store several values in cache with a single pipelined round-trip"""
+        if not items:
+            return
+        
+        try:
+            entries = [(self._normalize_key(key), value) for key, value in items.items()]
+            
+            # Store in Redis if available
+            if await self._ensure_redis():
+                # Values stored with set_many() are whole game analyses, so
+                # encode them off the event loop
+                encoded = await asyncio.to_thread(lambda: [_encode(value) for _, value in entries])
+                pipe = self.redis.pipeline(transaction=False)
+                for (cache_key, _), data in zip(entries, encoded):
+                    pipe.setex(cache_key, CACHE_TIMEOUT, data)
+                await pipe.execute()
+                
+            # Also store in memory cache as backup
+            for cache_key, value in entries:
+                self.memory_cache[cache_key] = value
+                
+            logger.debug(f"Cached data for {len(entries)} keys")
+            
+        except Exception as e:
+            logger.error(f"Error storing in cache: {str(e)}")
+    
+    async def get_game_analyses(self, username: str, game_ids: List[str]) -> Dict[str, Dict[str, Any]]:
+        """Get the stored analyses of a user's games by game ID; games not stored are omitted"""
+        keys = [_game_key(username, game_id) for game_id in game_ids]
+        found = await self.get_many(keys)
+        return {game_id: found[key] for game_id, key in zip(game_ids, keys) if key in found}
+    
+    async def set_game_analyses(self, username: str, games: List[Dict[str, Any]]) -> None:
+        """Store analyses of a user's games, one cache entry per game"""
+        await self.set_many({_game_key(username, game["game_id"]): game for game in games})
+    
+    async def get_analysis_raw(self, username: str) -> Optional[bytes]:
+        """Get a user's complete analysis as JSON bytes, assembled from its per-game entries"""
+        index = await self.get(_analysis_key(username))
+        if not index or "game_ids" not in index:  # also skips entries from before per-game storage
+            return None
+        
+        keys = [_game_key(username, game_id) for game_id in index["game_ids"]]
+        games = await self.get_many(keys, raw=True)
+        if len(games) != len(keys):
+            # A game entry expired before the index did
+            return None
+        
+        # Splice the stored game JSON together rather than decoding and re-encoding it
+        return b"".join((
+            b'{"games":[',
+            b",".join(games[key] for key in keys),
+            b'],"analysis_time":',
+            orjson.dumps(index["analysis_time"]),
+            b"}"
+        ))
+    
+    async def get_analysis(self, username: str) -> Optional[Dict[str, Any]]:
+        """Get a user's complete analysis, assembled from its per-game entries"""
+        data = await self.get_analysis_raw(username)
+        if data is None:
+            return None
+        return await _run_offloaded(orjson.loads, data)
+    
+    async def set_analysis(self, username: str, analysis: Dict[str, Any], store_games: bool = True) -> None:
+        """Store a user's complete analysis
+        
+        Games are stored as separate entries (skipped if store_games is False, when they
+        were already stored as they completed), so the top-level entry only indexes them.
+        """
+        games = analysis["games"]
+        if store_games:
+            await self.set_game_analyses(username, games)
+        await self.set(_analysis_key(username), {
+            "game_ids": [game["game_id"] for game in games],
+            "analysis_time": analysis["analysis_time"]
+        })
+    
+    async def get_positions(self, keys: List[int]) -> Dict[int, PositionEntry]:
+        """Look up shared position analyses by Zobrist hash; missing positions are omitted"""
+        results = {}
+        if not keys:
+            return results
+        
+        try:
+            # Positions are only shared through Redis; the analysis service
+            # keeps its own in-process table for the memory-only case
+            if await self._ensure_redis():
+                values = await self.redis.hmget(POSITION_TABLE_KEY, keys)
+                for key, data in zip(keys, values):
+                    if data:
+                        results[key] = orjson.loads(data)
+                        
+            logger.debug(f"Position table hits for {len(results)}/{len(keys)} positions")
+            
+        except Exception as e:
+            logger.error(f"Error retrieving positions from cache: {str(e)}")
+        return results
+    
+    async def set_positions(self, items: Dict[int, PositionEntry]) -> None:
+        """Store position analyses in the shared table with a single HSET"""
+        if not items:
+            return
+        
+        try:
+            if await self._ensure_redis():
+                pipe = self.redis.pipeline(transaction=False)
+                pipe.hset(POSITION_TABLE_KEY, mapping={key: orjson.dumps(value) for key, value in items.items()})
+                pipe.ttl(POSITION_TABLE_KEY)
+                _, ttl = await pipe.execute()
+                
+                # Expire the table as a whole once it has lived POSITION_CACHE_TIMEOUT,
+                # so it can't grow forever; the expiry is set once, not refreshed per write
+                if ttl < 0:
+                    await self.redis.expire(POSITION_TABLE_KEY, POSITION_CACHE_TIMEOUT)
+                    
+            logger.debug(f"Stored {len(items)} positions in position table")
+            
+        except Exception as e:
+            logger.error(f"Error storing positions in cache: {str(e)}")
+    
     def _normalize_key(self, key: str) -> str:
         """Create a consistent hash from any input string"""
-        return f"lotus_chess:{hashlib.md5(key.encode()).hexdigest()}"
+        # v2 keys use xxh3; v1 (md5) entries are left to expire
+        return f"lotus_chess:v2:{xxhash.xxh3_64_hexdigest(key.encode())}"
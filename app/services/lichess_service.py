@@ -1,101 +1,181 @@
 import asyncio
-import chess.pgn
-import io
-from typing import List, Dict, Any
+import chess
+import re
+from typing import List, Dict, Any, Optional, Tuple
 import logging
-import requests
+import aiohttp
 import time
-from app.config import LICHESS_API_URL, LICHESS_API_TOKEN, LICHESS_RATE_LIMIT_DELAY, MAX_GAMES
+from app.config import (
+    LICHESS_API_URL, LICHESS_API_TOKEN, LICHESS_RATE_LIMIT_DELAY, LICHESS_MAX_CONCURRENT_REQUESTS, MAX_GAMES
+)
 
 logger = logging.getLogger(__name__)
 
+# Tag pairs, e.g. [Site "https://lichess.org/abcd1234"]
+_HEADER_RE = re.compile(r'\[(\w+) "([^"]*)"\]')
+# Comments, which Lichess uses for clocks and evals
+_COMMENT_RE = re.compile(r"\{[^}]*\}")
+# SAN moves; move numbers, annotations and the result don't match
+_SAN_RE = re.compile(
+    r"(?:[KQRBN][a-h]?[1-8]?x?[a-h][1-8]|[a-h](?:x[a-h])?[1-8](?:=[QRBN])?|O-O(?:-O)?)[+#]?"
+)
+
+
+def _parse_single_pgn(pgn_text: str, game_number: int) -> Optional[Dict[str, Any]]:
+    """Parse one game's PGN into a game object
+    
+    Only the headers and the mainline SAN moves are needed, so the PGN is
+    tokenized with regexes rather than built into a python-chess game tree.
+    Moves are checked for legality when the game is replayed for analysis.
+    """
+    try:
+        pgn_text = pgn_text.strip()
+        header_text, _, move_text = pgn_text.partition("\n\n")
+        headers = dict(_HEADER_RE.findall(header_text))
+        if not headers and not move_text:
+            return None
+        
+        # Extract game ID from the Site header, which contains the URL
+        site = headers.get("Site", "")
+        game_id = site.split("/")[-1] if "/" in site else f"game_{game_number}"
+        
+        # Store the starting position and the moves only; positions along the
+        # game are replayed from them when the game is analyzed
+        parsed_game = {
+            "game_id": game_id,
+            "time_control": headers.get("TimeControl", ""),
+            "pgn": pgn_text,  # the raw block this game was parsed from
+            "start_fen": headers.get("FEN", chess.STARTING_FEN),
+            "moves_san": _SAN_RE.findall(_COMMENT_RE.sub(" ", move_text))
+        }
+        
+        # Log game headers for debugging
+        logger.debug(f"Game {game_id} headers: {headers}")
+        
+        logger.info(f"Parsed game {game_id} with {len(parsed_game['moves_san'])} moves")
+        
+        if not parsed_game["moves_san"]:
+            logger.warning(f"No moves parsed for game {game_id}")
+        
+        return parsed_game
+    except Exception as e:
+        logger.error(f"Error parsing game: {str(e)}")
+        return None
+
+
+def _translate_moves(game_id: str, moves_uci: List[str]) -> Tuple[List[str], List[str]]:
+    """Convert a game's UCI moves to SAN, returning the (UCI, SAN) moves up to the first bad one"""
+    board = chess.Board()
+    moves_san = []
+    for i, move_uci in enumerate(moves_uci):
+        try:
+            # Parse the UCI move
+            move = chess.Move.from_uci(move_uci)
+            # Convert to SAN and apply the move to advance the board
+            moves_san.append(board.san_and_push(move))
+        except Exception as e:
+            logger.error(f"Error parsing move {i+1} of game {game_id}: {str(e)}")
+            break
+    return moves_uci[:len(moves_san)], moves_san
+
+
 class LichessService:
-    def __init__(self):
+    # Request parameters shared by every call; only "max" varies.
+    # Only blitz and rapid games are fetched
+    _STANDARD_PARAMS = {
+        "perfType": "blitz,rapid",
+        "ongoing": "false",
+        "finished": "true",
+        "sort": "dateDesc",
+        "pgnInJson": "false",  # Ensure we get proper PGN format
+        "clocks": "false",     # We don't need clock times
+        "evals": "false",      # We'll do our own evals
+        "opening": "false"     # Don't need opening info
+    }
+    _ALTERNATIVE_PARAMS = {
+        "perfType": "blitz,rapid",
+        "ongoing": "false",
+        "finished": "true",
+        "sort": "dateDesc",
+        "moves": "true",       # Include moves in the output
+        "pgnInJson": "true",   # Include PGN in the JSON
+        "clocks": "false",
+        "evals": "false"
+    }
+    
+    # Authentication, if configured, is sent by the session
+    _STANDARD_HEADERS = {"Accept": "application/x-chess-pgn"}
+    _ALTERNATIVE_HEADERS = {"Accept": "application/json"}
+    
+    def __init__(self, store_san: bool = False):
         self.rate_limit_delay = LICHESS_RATE_LIMIT_DELAY
+        # Whether games from the JSON endpoint include SAN moves; without them, SAN
+        # is derived when the game is replayed for analysis. PGN games always have
+        # SAN, since that is what PGN carries
+        self.store_san = store_san
         self.api_token = LICHESS_API_TOKEN
+        self._session = None
+        self._request_slots = None
     
     async def setup(self):
-        # No need for setup with requests
-        pass
+        """Open the HTTP session, which keeps connections to Lichess alive between requests"""
+        if self._session is None or self._session.closed:
+            headers = {"Authorization": f"Bearer {self.api_token}"} if self.api_token else {}
+            self._session = aiohttp.ClientSession(
+                headers=headers,
+                connector=aiohttp.TCPConnector(limit=32, ttl_dns_cache=300)
+            )
+            # Bounds the requests in flight to Lichess
+            self._request_slots = asyncio.Semaphore(LICHESS_MAX_CONCURRENT_REQUESTS)
     
     async def close(self):
-        # No need to close anything with requests
-        pass
+        """Close the HTTP session"""
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
     
     async def get_user_games(self, username: str, max_games: int = MAX_GAMES) -> List[Dict[str, Any]]:
         """
         Fetch the last N rapid/blitz games for a given Lichess username
         Returns a list of chess games in PGN format
         """
+        await self.setup()
+        
         # Try the standard API endpoint first
         games = await self._get_games_standard_api(username, max_games)
         
-        # If we didn't get any moves, try the alternative API endpoint
-        if games and all(len(game.get("moves", [])) == 0 for game in games):
+        # If we didn't get any moves, try the alternative API endpoint. any() stops
+        # at the first game with moves, so normally only the first game is checked
+        if games and not any(game.get("moves_san") or game.get("moves_uci") for game in games):
             logger.warning(f"No moves found in games from standard API, trying alternative endpoint")
+            # Respect rate limiting between requests to Lichess
+            await asyncio.sleep(self.rate_limit_delay)
             games = await self._get_games_alternative_api(username, max_games)
         
         return games
         
     async def _get_games_standard_api(self, username: str, max_games: int) -> List[Dict[str, Any]]:
         """Use the standard API to get games"""
-        # Prepare API parameters - only blitz and rapid games
-        params = {
-            "max": max_games,
-            "perfType": "blitz,rapid",
-            "ongoing": "false",
-            "finished": "true",
-            "sort": "dateDesc",
-            "pgnInJson": "false",  # Ensure we get proper PGN format
-            "clocks": "false",     # We don't need clock times
-            "evals": "false",      # We'll do our own evals
-            "opening": "false"     # Don't need opening info
-        }
+        params = {**self._STANDARD_PARAMS, "max": max_games}
         
         games = []
         try:
-            # Prepare headers with authentication if available
-            headers = {"Accept": "application/x-chess-pgn"}
-            if self.api_token:
-                headers["Authorization"] = f"Bearer {self.api_token}"
-            
-            # Use requests to make a synchronous call in an executor
             url = f"{LICHESS_API_URL}/games/user/{username}"
             logger.info(f"Fetching games for {username} from {url}")
             
-            # Run the request in a thread pool to not block asyncio
-            def make_request():
-                try:
-                    resp = requests.get(url, params=params, headers=headers, verify=False)
-                    return resp
-                except Exception as e:
-                    logger.error(f"Error in HTTP request: {str(e)}")
-                    raise
-            
-            # Execute the request in a separate thread
-            response = await asyncio.get_event_loop().run_in_executor(None, make_request)
-            
-            if response.status_code != 200:
-                logger.error(f"Lichess API error: {response.status_code} - {response.text}")
-                return []
-            
-            # Parse PGN data
-            pgn_text = response.text
-            logger.info(f"Received {len(pgn_text)} bytes of PGN data")
-            
-            # Debug - log a snippet of the PGN data
-            if pgn_text:
-                logger.info(f"PGN snippet: {pgn_text[:200]}...")
-            else:
-                logger.warning("Received empty PGN data from Lichess API")
-                return []
-            
-            # Parse the PGN data into game objects
-            parsed_games = await self._parse_pgn_games(pgn_text)
+            async with self._request_slots, self._session.get(
+                url, params=params, headers=self._STANDARD_HEADERS
+            ) as response:
+                if response.status != 200:
+                    logger.error(f"Lichess API error: {response.status} - {await response.text()}")
+                    return []
+                
+                # Parse the PGN data into game objects as it downloads
+                parsed_games = await self._parse_pgn_stream(response.content)
             logger.info(f"Parsed {len(parsed_games)} games from Lichess")
             return parsed_games
             
-        except requests.RequestException as e:
+        except aiohttp.ClientError as e:
             logger.error(f"Error fetching games for {username}: {str(e)}")
             return []
         except Exception as e:
@@ -104,45 +184,23 @@ class LichessService:
             
     async def _get_games_alternative_api(self, username: str, max_games: int) -> List[Dict[str, Any]]:
         """Try the alternative API endpoint that returns JSON directly"""
-        params = {
-            "max": max_games,
-            "perfType": "blitz,rapid",
-            "ongoing": "false",
-            "finished": "true",
-            "sort": "dateDesc",
-            "moves": "true",       # Include moves in the output
-            "pgnInJson": "true",   # Include PGN in the JSON
-            "clocks": "false",
-            "evals": "false"
-        }
+        params = {**self._ALTERNATIVE_PARAMS, "max": max_games}
         
         games = []
         try:
-            # Prepare headers
-            headers = {"Accept": "application/json"}
-            if self.api_token:
-                headers["Authorization"] = f"Bearer {self.api_token}"
-            
             # Alternative endpoint
             url = f"{LICHESS_API_URL}/games/user/{username}"
             logger.info(f"Fetching games using alternative endpoint: {url}")
             
-            def make_request():
-                try:
-                    resp = requests.get(url, params=params, headers=headers, verify=False)
-                    return resp
-                except Exception as e:
-                    logger.error(f"Error in HTTP request: {str(e)}")
-                    raise
-            
-            response = await asyncio.get_event_loop().run_in_executor(None, make_request)
-            
-            if response.status_code != 200:
-                logger.error(f"Lichess API error: {response.status_code} - {response.text}")
-                return []
-            
-            # Parse JSON data
-            json_data = response.json()
+            async with self._request_slots, self._session.get(
+                url, params=params, headers=self._ALTERNATIVE_HEADERS
+            ) as response:
+                if response.status != 200:
+                    logger.error(f"Lichess API error: {response.status} - {await response.text()}")
+                    return []
+                
+                # Parse JSON data, whatever content type it is served with
+                json_data = await response.json(content_type=None)
             logger.info(f"Received JSON data with {len(json_data)} games")
             
             # Convert JSON games to our format
@@ -155,108 +213,62 @@ class LichessService:
                     "game_id": game_id,
                     "time_control": time_control,
                     "pgn": game_json.get("pgn", ""),
-                    "moves": []
+                    "start_fen": chess.STARTING_FEN,
+                    "moves_uci": []
                 }
                 
-                # Parse moves from the JSON directly
-                moves_str = game_json.get("moves", "").split()
-                
-                # We need to convert UCI moves to SAN format
-                board = chess.Board()
-                for i, move_uci in enumerate(moves_str):
-                    try:
-                        # Parse the UCI move
-                        move = chess.Move.from_uci(move_uci)
-                        # Convert to SAN
-                        move_san = board.san(move)
-                        # Get FEN before the move
-                        fen = board.fen()
-                        # Add to our moves list
-                        parsed_game["moves"].append({
-                            "move_number": i + 1,
-                            "fen": fen,
-                            "played_move": move_san
-                        })
-                        # Apply the move to advance the board
-                        board.push(move)
-                    except Exception as e:
-                        logger.error(f"Error parsing move {i+1} of game {game_id}: {str(e)}")
-                
-                logger.info(f"Parsed game {game_id} with {len(parsed_game['moves'])} moves from JSON")
+                # Parse moves from the JSON directly; Lichess already sends UCI
+                parsed_game["moves_uci"] = game_json.get("moves", "").split()
                 games.append(parsed_game)
-                
-                # Respect rate limiting
-                await asyncio.sleep(self.rate_limit_delay)
             
+            # Convert UCI moves to SAN format if wanted, each game in a worker
+            # thread so the event loop isn't held for the whole batch
+            if self.store_san:
+                translated = await asyncio.gather(*[
+                    asyncio.to_thread(_translate_moves, game["game_id"], game["moves_uci"])
+                    for game in games
+                ])
+                for game, (moves_uci, moves_san) in zip(games, translated):
+                    game["moves_uci"] = moves_uci
+                    game["moves_san"] = moves_san
+            
+            for game in games:
+                logger.info(f"Parsed game {game['game_id']} with {len(game['moves_uci'])} moves from JSON")
             return games
             
         except Exception as e:
             logger.error(f"Error fetching games from alternative API: {str(e)}")
             return []
     
-    async def _parse_pgn_games(self, pgn_text: str) -> List[Dict[str, Any]]:
-        """Parse a multi-game PGN string into a list of game objects"""
+    async def _parse_pgn_stream(self, stream: aiohttp.StreamReader) -> List[Dict[str, Any]]:
+        """Parse a multi-game PGN response into a list of game objects while it downloads"""
         games = []
-        if not pgn_text.strip():
-            logger.warning("Empty PGN text received, cannot parse games")
-            return games
-            
-        pgn_io = io.StringIO(pgn_text)
-        
-        # Process each game in the PGN
         game_count = 0
-        while True:
-            try:
-                game = chess.pgn.read_game(pgn_io)
-                if game is None:  # End of file
-                    break
-                
+        lines = []
+        received = 0
+        
+        def submit():
+            # Tokenizing a game takes microseconds, so it's done inline
+            nonlocal game_count
+            pgn_text = "".join(lines)
+            if pgn_text.strip():
                 game_count += 1
-                
-                # Extract game ID from the Site header, which contains the URL
-                site = game.headers.get("Site", "")
-                game_id = site.split("/")[-1] if "/" in site else f"game_{game_count}"
-                
-                parsed_game = {
-                    "game_id": game_id,
-                    "time_control": game.headers.get("TimeControl", ""),
-                    "pgn": str(game),
-                    "moves": []
-                }
-                
-                # Log game headers for debugging
-                logger.info(f"Game {game_id} headers: {dict(game.headers)}")
-                
-                # Parse moves
-                board = game.board()
-                move_count = 0
-                
-                for i, move in enumerate(game.mainline_moves()):
-                    move_count += 1
-                    try:
-                        move_san = board.san(move)
-                        fen = board.fen()
-                        parsed_game["moves"].append({
-                            "move_number": i + 1,
-                            "fen": fen,
-                            "played_move": move_san
-                        })
-                        board.push(move)
-                    except Exception as e:
-                        logger.error(f"Error parsing move {i+1} of game {game_id}: {str(e)}")
-                
-                logger.info(f"Parsed game {game_id} with {len(parsed_game['moves'])} moves")
-                
-                if not parsed_game["moves"]:
-                    logger.warning(f"No moves parsed for game {game_id}")
-                
-                games.append(parsed_game)
-            except Exception as e:
-                logger.error(f"Error parsing game: {str(e)}")
-                # Continue to next game
-                continue
-                
-            # Respect rate limiting
-            await asyncio.sleep(self.rate_limit_delay)
+                game = _parse_single_pgn(pgn_text, game_count)
+                if game is not None:
+                    games.append(game)
+        
+        # Each game starts with an [Event tag, so the previous game is complete once
+        # the next one begins and can be parsed while the rest downloads
+        async for line in stream:
+            received += len(line)
+            text = line.decode()
+            if text.startswith("[Event ") and lines:
+                submit()
+                lines = []
+            lines.append(text)
+        submit()
         
-        return games
\ No newline at end of file
+        logger.info(f"Received {received} bytes of PGN data")
+        if not game_count:
+            logger.warning("Received empty PGN data from Lichess API")
+        return games
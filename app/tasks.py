@@ -2,22 +2,46 @@
 Celery tasks for handling long-running chess analysis jobs
 """
 import os
+import socket
 import sys
 from pathlib import Path
 from celery import Celery
-import json
 import logging
+import orjson
 import redis
+from kombu.serialization import register
 
 # Add the parent directory to the Python path so imports work correctly
 sys.path.insert(0, str(Path(__file__).parent.parent.parent))
 
-from app.config import REDIS_URL
+from app.config import REDIS_URL, ENGINE_POOL_SIZE, ENGINE_THREADS
 
 logger = logging.getLogger(__name__)
 
-# Create Redis client for pub/sub
-redis_client = redis.from_url(REDIS_URL)
+# Redis client for pub/sub, created on first publish so importing this module
+# (as the web process does) doesn't set one up
+_redis_client = None
+
+
+def _get_redis():
+    global _redis_client
+    if _redis_client is None:
+        # One pool for every task this worker runs; callers wait for a free
+        # connection rather than opening more than max_connections
+        pool = redis.BlockingConnectionPool.from_url(
+            REDIS_URL,
+            max_connections=16,
+            socket_keepalive=True,
+            # TCP_KEEPIDLE isn't available on every platform (e.g. macOS)
+            socket_keepalive_options={socket.TCP_KEEPIDLE: 60} if hasattr(socket, "TCP_KEEPIDLE") else None
+        )
+        _redis_client = redis.Redis(connection_pool=pool)
+    return _redis_client
+
+# orjson serializer for task results, which can be several MB of analysis JSON
+register('orjson', orjson.dumps, orjson.loads,
+         content_type='application/x-orjson',
+         content_encoding='binary')
 
 # Create Celery app
 celery_app = Celery('lotus_chess',
@@ -28,10 +52,15 @@ celery_app = Celery('lotus_chess',
 celery_app.conf.update(
     task_serializer='json',
     accept_content=['json'],
-    result_serializer='json',
+    result_serializer='orjson',
+    result_accept_content=['json', 'orjson'],  # json for results stored before the switch
     task_track_started=True,
     task_time_limit=300,  # 5 minutes max for analysis tasks
     worker_prefetch_multiplier=1,  # Don't prefetch tasks
+    # Each analysis task runs its own pool of Stockfish processes, which is where
+    # the CPU goes; the task's own I/O is async. Run only as many tasks at once
+    # as there are cores for their engines (pool size x engine threads)
+    worker_concurrency=max(1, (os.cpu_count() or 1) // (ENGINE_POOL_SIZE * ENGINE_THREADS)),
 )
 
 @celery_app.task(bind=True, name='analyze_games')
@@ -54,23 +83,27 @@ def analyze_games_task(self, username: str):
         # Create analysis service
         service = AnalysisService()
         
+        # Progress is reported per position, so most ticks repeat the previous
+        # percentage; only those that change it are sent to Redis
+        last_percent = None
+        progress_update = {'job_id': self.request.id, 'status': 'progress'}
+        
         # Set up progress tracking callback
         def progress_callback(current, total, status):
+            nonlocal last_percent
             percent = int(100 * current / max(total, 1))
+            if percent == last_percent:
+                return
+            last_percent = percent
+            
             self.update_state(state='PROGRESS', 
                                meta={'progress': percent, 'status': status})
             
             # Publish progress updates to Redis
             try:
-                redis_client.publish(
-                    'job_updates',
-                    json.dumps({
-                        'job_id': self.request.id,
-                        'status': 'progress',
-                        'progress': percent,
-                        'message': status
-                    })
-                )
+                progress_update['progress'] = percent
+                progress_update['message'] = status
+                _get_redis().publish('job_updates', orjson.dumps(progress_update))
             except Exception as e:
                 logger.error(f"Error publishing progress to Redis: {str(e)}")
         
@@ -89,9 +122,9 @@ def analyze_games_task(self, username: str):
         
         # Publish completion event to Redis
         try:
-            redis_client.publish(
+            _get_redis().publish(
                 'job_updates',
-                json.dumps({
+                orjson.dumps({
                     'job_id': self.request.id,
                     'status': 'completed',
                     'progress': 100,
@@ -110,9 +143,9 @@ def analyze_games_task(self, username: str):
         
         # Publish error event to Redis
         try:
-            redis_client.publish(
+            _get_redis().publish(
                 'job_updates',
-                json.dumps({
+                orjson.dumps({
                     'job_id': self.request.id,
                     'status': 'failed',
                     'progress': 0,
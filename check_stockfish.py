@@ -16,7 +16,9 @@ logger = logging.getLogger(__name__)
 # Add parent directory to path for imports
 sys.path.insert(0, str(Path(__file__).parent))
 
-from app.config import STOCKFISH_PATH
+from app.config import get_stockfish_path
+
+STOCKFISH_PATH = get_stockfish_path()
 
 async def test_stockfish():
     """Test if Stockfish can be run and returns a valid UCI response"""
@@ -11,6 +11,7 @@ import zipfile
 from pathlib import Path
 import logging
 import requests
+from requests.adapters import HTTPAdapter
 import tempfile
 
 # Configure logging
@@ -25,16 +26,21 @@ STOCKFISH_URLS = {
     "Linux": "https://github.com/official-stockfish/Stockfish/releases/download/sf_16.1/stockfish-ubuntu-x86-64-avx2.tar"
 }
 
+# Shared session so the download and its redirect reuse pooled connections
+_SESSION = requests.Session()
+_SESSION.mount("https://", HTTPAdapter(pool_connections=10, pool_maxsize=10))
+
 def download_file(url, output_path):
     """Download a file from a URL to a specific location"""
     logger.info(f"Downloading from {url}...")
     try:
-        response = requests.get(url, stream=True)
+        response = _SESSION.get(url, stream=True)
         response.raise_for_status()
         
         total_size = int(response.headers.get('content-length', 0))
-        block_size = 8192
+        block_size = 1024 * 1024
         downloaded = 0
+        last_percent = -1
         
         with open(output_path, 'wb') as f:
             for chunk in response.iter_content(chunk_size=block_size):
@@ -42,11 +48,13 @@ def download_file(url, output_path):
                     f.write(chunk)
                     downloaded += len(chunk)
                     
-                    # Simple progress indicator
+                    # Simple progress indicator, redrawn only when the percentage changes
                     if total_size:
                         percent = int((downloaded / total_size) * 100)
-                        sys.stdout.write(f"\rDownloaded: {percent}% ({downloaded}/{total_size} bytes)")
-                        sys.stdout.flush()
+                        if percent != last_percent:
+                            last_percent = percent
+                            sys.stdout.write(f"\rDownloaded: {percent}% ({downloaded}/{total_size} bytes)")
+                            sys.stdout.flush()
         
         logger.info(f"\nDownload completed: {output_path}")
         return True
@@ -85,22 +93,14 @@ def find_executable(extract_dir):
     system = platform.system()
     
     logger.info(f"Looking for Stockfish executable in {extract_dir}")
-    # Walk through the extracted directory to find the Stockfish executable
-    for root, dirs, files in os.walk(extract_dir):
-        # Log what we're finding to help with debugging
-        logger.info(f"Searching in directory: {root}")
-        logger.info(f"Found files: {files}")
-        
-        for file in files:
-            # Look for the Stockfish executable based on the platform
-            if system == "Windows" and file.startswith("stockfish") and file.endswith(".exe"):
-                logger.info(f"Found Windows Stockfish executable: {file}")
-                return Path(root) / file
-            elif system != "Windows":
-                # For macOS and Linux, look for any file that might be the stockfish binary
-                if "stockfish" in file.lower():
-                    logger.info(f"Found potential Stockfish executable: {file}")
-                    return Path(root) / file
+    # Search the extracted tree once, stopping at the first match. On macOS and
+    # Linux the executable bit tells the binary apart from other stockfish* files
+    pattern = "stockfish*.exe" if system == "Windows" else "*stockfish*"
+    for path in Path(extract_dir).rglob(pattern):
+        logger.debug(f"Checking {path}")
+        if path.is_file() and (system == "Windows" or os.access(path, os.X_OK)):
+            logger.info(f"Found Stockfish executable: {path}")
+            return path
     
     logger.error("Could not find Stockfish executable in extracted files")
     return None
@@ -156,22 +156,7 @@ def main():
         # Find the executable
         executable_path = find_executable(extract_dir)
         if not executable_path:
-            # If we couldn't find it automatically, try a manual approach for macOS
-            if system == "Darwin":
-                # For macOS tar files, sometimes the binary is directly the stockfish file in the archive
-                for root, dirs, files in os.walk(extract_dir):
-                    for file in files:
-                        file_path = Path(root) / file
-                        if os.access(file_path, os.X_OK):
-                            logger.info(f"Found executable file: {file_path}")
-                            executable_path = file_path
-                            break
-                    if executable_path:
-                        break
-            
-            if not executable_path:
-                logger.error("Could not find Stockfish executable in extracted files")
-                return False
+            return False
         
         dest_path = stockfish_dir / dest_filename
         